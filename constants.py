@@ -1,16 +1,31 @@
-import os
-from dotenv import load_dotenv
-from chromadb.config import Settings
-
-load_dotenv()
-
-# Define the folder for storing database
-PERSIST_DIRECTORY = os.environ.get('PERSIST_DIRECTORY')
-
-# Define the Chroma settings
-CHROMA_SETTINGS = Settings(
-        chroma_db_impl='duckdb+parquet',
-        persist_directory=PERSIST_DIRECTORY,
-        anonymized_telemetry=False
-)
-
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+import chromadb
+from chromadb.config import Settings
+
+load_dotenv()
+
+# Define the folder for storing database
+PERSIST_DIRECTORY = os.environ.get('PERSIST_DIRECTORY')
+
+# Collection settings - inner-product space (our embeddings are normalised,
+# so this ranks identically to cosine) and HNSW parameters tuned for faster
+# index builds and a configurable recall/latency tradeoff at query time
+COLLECTION_NAME = "private-gpt"
+COLLECTION_METADATA = {
+    "hnsw:space": "ip",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+
+@lru_cache(maxsize=1)
+def get_chroma_client():
+    '''Shared persistent Chroma client (sqlite-backed, persists on write)'''
+
+    return chromadb.PersistentClient(
+        path=PERSIST_DIRECTORY,
+        settings=Settings(anonymized_telemetry=False)
+    )
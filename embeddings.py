@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# shared embeddings loader - keeps the SentenceTransformer loaded once per
+# process so every caller shares the same model instance
+
+import os
+import logging
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import torch
+from dotenv import load_dotenv
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+
+# Load environment
+load_dotenv()
+
+# Load environment variables
+embeddings_model_name = os.environ.get('EMBEDDINGS_MODEL_NAME')
+use_onnx = os.environ.get('EMBEDDINGS_USE_ONNX', 'false').lower() in ('true', '1', 'yes')
+
+# local folder for cached artifacts (ONNX export, ingest index)
+cache_directory = os.environ.get('EMBEDDINGS_CACHE_DIRECTORY', '.cache')
+onnx_directory = os.path.join(cache_directory, 'emb_onnx')
+
+
+class OnnxEmbeddings(Embeddings):
+    '''Embeddings backed by an ONNX Runtime export of the sentence transformer.
+    Graph fusions give roughly a 4x speedup over eager PyTorch on CPU.
+    Requires the optional optimum[onnxruntime] dependency (see requirements.txt).
+    '''
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.batch_size = batch_size
+
+        if os.path.exists(onnx_directory):
+            # reuse the exported model from a previous run
+            self.model = ORTModelForFeatureExtraction.from_pretrained(onnx_directory)
+            self.tokenizer = AutoTokenizer.from_pretrained(onnx_directory)
+        else:
+            # first run - export the model to ONNX and keep it for next time
+            logging.info(f"Exporting {model_name} to ONNX (one-off, may take a minute)")
+            self.model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+            os.makedirs(cache_directory, exist_ok=True)
+            self.model.save_pretrained(onnx_directory)
+            self.tokenizer.save_pretrained(onnx_directory)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(texts[i:i + self.batch_size], padding=True,
+                                   truncation=True, return_tensors="np")
+            hidden = self.model(**batch).last_hidden_state
+
+            # mean-pool over real (non-padding) tokens then L2-normalise
+            mask = batch["attention_mask"][..., None]
+            pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+            vectors.append(pooled / np.linalg.norm(pooled, axis=1, keepdims=True))
+
+        return np.concatenate(vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def set_encode_batch_size(embeddings: Embeddings, batch_size: int) -> None:
+    '''Adjust the encoder batch size on whichever embeddings backend is in use'''
+
+    if isinstance(embeddings, HuggingFaceEmbeddings):
+        embeddings.encode_kwargs["batch_size"] = batch_size
+    elif isinstance(embeddings, OnnxEmbeddings):
+        embeddings.batch_size = batch_size
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> Embeddings:
+    '''Create the embeddings model once and reuse it for the whole process'''
+
+    if use_onnx:
+        # opt-in ONNX Runtime path - falls back to PyTorch if optimum is missing
+        try:
+            return OnnxEmbeddings(model_name=embeddings_model_name)
+        except ImportError as e:
+            logging.warning(f"EMBEDDINGS_USE_ONNX set but optimum[onnxruntime] not installed ({e}), using PyTorch")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    embeddings = HuggingFaceEmbeddings(
+        model_name=embeddings_model_name,
+        model_kwargs={"device": device},
+        # encode many chunks per forward pass - single-sample encoding leaves
+        # the GPU (and CPU vector units) mostly idle; keep results in numpy
+        # (no tensor->list->numpy roundtrip) and pre-normalise so the index
+        # can use plain inner-product distance
+        encode_kwargs={"batch_size": 64, "show_progress_bar": True,
+                       "convert_to_numpy": True, "normalize_embeddings": True}
+    )
+
+    if device == "cuda":
+        # half precision doubles embed throughput and halves VRAM; the
+        # ~1e-3 perturbation is far below what affects retrieval ranking
+        embeddings.client.half()
+
+    return embeddings
@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
+import hashlib
 import os
-import glob
 import logging
+import multiprocessing
+import sqlite3
 import sys
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List
+from collections import deque
 from dotenv import load_dotenv
-from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
 from tqdm import tqdm
 
 from langchain.document_loaders import (
     CSVLoader,
     EverNoteLoader,
-    PyMuPDFLoader,
     TextLoader,
     UnstructuredEmailLoader,
     UnstructuredEPubLoader,
@@ -19,16 +22,21 @@ from langchain.document_loaders import (
     UnstructuredMarkdownLoader,
     UnstructuredODTLoader,
     UnstructuredPowerPointLoader,
-    UnstructuredWordDocumentLoader,
-    Docx2txtLoader
-
+    UnstructuredWordDocumentLoader
 )
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
+
+# Rust-backed splitter is much faster than the pure-Python langchain one;
+# fall back to langchain if the optional package is not installed
+try:
+    from semantic_text_splitter import TextSplitter as RustTextSplitter
+except ImportError:
+    RustTextSplitter = None
 from langchain.docstore.document import Document
-from constants import CHROMA_SETTINGS
+from constants import COLLECTION_NAME, COLLECTION_METADATA, get_chroma_client
+from embeddings import get_embeddings, set_encode_batch_size, cache_directory
 
 # Load environment
 load_dotenv()
@@ -36,10 +44,15 @@ load_dotenv()
 # Load environment variables
 persist_directory = os.environ.get('PERSIST_DIRECTORY')
 source_directory = os.environ.get('SOURCE_DIRECTORY', 'source_documents')
-embeddings_model_name = os.environ.get('EMBEDDINGS_MODEL_NAME')
 chunk_size = 500
 chunk_overlap = 50
-max_number_of_parts_per_run=5100 # adjust based on performance of laptop - 
+chunk_batch_size = 1024 # how many chunks to buffer before flushing to Chroma
+db_batch_size = 512 # how many chunks to upsert into Chroma per call
+# encoder batch size per content-length bucket - short texts can share much
+# larger batches than long ones before padding dominates the forward pass
+length_buckets = ((128, 128), (384, 64), (float("inf"), 16))
+ingest_workers = int(os.environ.get('INGEST_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+load_timeout = int(os.environ.get('INGEST_LOAD_TIMEOUT', 120)) # seconds per file
 
 
 
@@ -67,10 +80,66 @@ class MyElmLoader(UnstructuredEmailLoader):
         return doc
 
 
+def load_pdf_pages(file_path: str, start: int, stop: int) -> List[Document]:
+    '''Extract a range of pages from a PDF as Documents (also run in workers)'''
+
+    import fitz
+    with fitz.open(file_path) as pdf:
+        return [Document(page_content=pdf[page].get_text(),
+                         metadata={"source": file_path, "page": page})
+                for page in range(start, stop)]
+
+
+class FastPDFLoader:
+    """
+    PDF loader that streams pages straight through PyMuPDF, skipping the
+    per-page overhead of PyMuPDFLoader. Very large PDFs are parallelised
+    across the loader pool by iter_documents (see large_pdf_page_ranges),
+    not here - the loader itself always runs inside a pool worker.
+    """
+
+    parallel_page_threshold = 200
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def load(self) -> List[Document]:
+        import fitz
+        with fitz.open(self.file_path) as pdf:
+            page_count = pdf.page_count
+        return load_pdf_pages(self.file_path, 0, page_count)
+
+
+def large_pdf_page_ranges(file_path: str):
+    """
+    Page ranges for fanning one very large PDF across the loader pool, or
+    None for files the pool should load whole. Opening the PDF just to read
+    the page count is cheap - no page content is parsed.
+    """
+    if os.path.splitext(file_path)[1].lower() != ".pdf":
+        return None
+
+    import fitz
+    try:
+        with fitz.open(file_path) as pdf:
+            page_count = pdf.page_count
+    except Exception:
+        # broken file - let the loader surface the error through the
+        # normal per-file handling
+        return None
+
+    if page_count < FastPDFLoader.parallel_page_threshold:
+        return None
+
+    # ceil-divide the pages into one range per worker
+    pages_per_worker = -(-page_count // ingest_workers)
+    return [(start, min(start + pages_per_worker, page_count))
+            for start in range(0, page_count, pages_per_worker)]
+
+
 # Map file extensions to document loaders and their arguments
 LOADER_MAPPING = {
     ".csv": (CSVLoader, {}),
-     ".docx": (Docx2txtLoader, {}),
     ".doc": (UnstructuredWordDocumentLoader, {}),
     ".docx": (UnstructuredWordDocumentLoader, {}),
     ".enex": (EverNoteLoader, {}),
@@ -79,7 +148,7 @@ LOADER_MAPPING = {
     ".html": (UnstructuredHTMLLoader, {}),
     ".md": (UnstructuredMarkdownLoader, {}),
     ".odt": (UnstructuredODTLoader, {}),
-    ".pdf": (PyMuPDFLoader, {}),
+    ".pdf": (FastPDFLoader, {}),
     ".ppt": (UnstructuredPowerPointLoader, {}),
     ".pptx": (UnstructuredPowerPointLoader, {}),
     ".txt": (TextLoader, {"encoding": "utf8"}),
@@ -88,10 +157,59 @@ LOADER_MAPPING = {
 
 
 
+def open_ingest_index() -> sqlite3.Connection:
+    '''Open (creating if needed) the side-car index of already-ingested files'''
+
+    os.makedirs(cache_directory, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(cache_directory, 'ingest_index.sqlite'))
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INT)")
+    return connection
+
+
+
+
+def reset_ingest_index() -> None:
+    '''Clear the side-car index so every source file is treated as new'''
+
+    index = open_ingest_index()
+    index.execute("DELETE FROM files")
+    index.commit()
+    index.close()
+
+
+
+
+def prune_deleted_files(db: Chroma) -> None:
+    '''Remove vectorstore entries for files that no longer exist on disk'''
+
+    index = open_ingest_index()
+    deleted = [path for (path,) in index.execute("SELECT path FROM files")
+               if not os.path.exists(path)]
+
+    for path in deleted:
+        logging.info(f"Removing deleted file from vectorstore: {path}")
+        db._collection.delete(where={"source": path})
+        index.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    index.commit()
+    index.close()
+
+
+
+
+def init_loader_worker() -> None:
+    '''Pre-import the heavyweight loader dependencies once per worker process'''
+
+    import langchain.document_loaders  # noqa: F401
+
+
+
+
 def load_single_document(file_path: str) -> List[Document]:
     '''Load a single document from a given file path using the predefined loader list'''
 
-    ext = "." + file_path.rsplit(".", 1)[-1]
+    ext = os.path.splitext(file_path)[1].lower()
     if ext in LOADER_MAPPING:
 
         #load the appropriate class and execute it's load method
@@ -105,83 +223,289 @@ def load_single_document(file_path: str) -> List[Document]:
 
 
 
-def load_documents(source_dir: str, ignored_files: List[str] = []) -> List[Document]:
+def scan_source_files(source_dir: str) -> List[str]:
+    """
+    Walk the source tree with os.scandir, collecting files with a supported extension.
+    One pass and one stat per entry, rather than one recursive glob per extension.
+    """
+    found = []
+    try:
+        entries = os.scandir(source_dir)
+    except OSError:
+        # missing or unreadable source directory - find nothing, like the
+        # old glob did, so ingest exits cleanly with "no new documents"
+        return found
+
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                found.extend(scan_source_files(entry.path))
+            elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in LOADER_MAPPING:
+                found.append(entry.path)
+    return found
+
+
+
+
+def select_files_to_ingest(db: Chroma, ignored_files: List[str] = []) -> List[str]:
     """
-    Loads all documents from the source documents directory, ignoring specified files
+    Decide which source files need (re-)parsing. Files whose mtime/size match
+    their ingest-index row are skipped; files recorded in the index but since
+    modified have their stale chunks deleted from the vectorstore and are
+    parsed again; files in the vectorstore but not the index (stores predating
+    the index) are left alone rather than duplicated.
     """
-    all_files = []
-    for ext in LOADER_MAPPING:
-        all_files.extend(
-            glob.glob(os.path.join(source_dir, f"**/*{ext}"), recursive=True)
-        )
+    # deduplicate the scan in case overlapping paths yield a file twice
+    all_files = dict.fromkeys(scan_source_files(source_directory))
+
+    # compare mtime/size numerically - SQLite stores the REAL mtime as the
+    # exact binary double, but any string rendering of it loses precision
+    index = open_ingest_index()
+    known_files = {path: (mtime, size)
+                   for path, mtime, size in index.execute("SELECT path, mtime, size FROM files")}
+    index.close()
+
+    ignored = set(ignored_files)
+    to_ingest = []
+    unchanged = 0
+
+    for file_path in all_files:
+        stat = os.stat(file_path)
+        if known_files.get(file_path) == (stat.st_mtime, stat.st_size):
+            # unchanged since its last ingest
+            unchanged += 1
+        elif file_path in known_files:
+            # modified - drop its stale chunks before parsing it again
+            logging.info(f"Re-ingesting changed file: {file_path}")
+            db._collection.delete(where={"source": file_path})
+            to_ingest.append(file_path)
+        elif file_path not in ignored:
+            # brand new file (not in the index or the vectorstore)
+            to_ingest.append(file_path)
+
+    if unchanged:
+        logging.info(f"Skipping {unchanged} unchanged file(s) already in the index")
 
-    # gather all files on this path as long as it is not on our list    
-    filtered_files = [file_path for file_path in all_files if file_path not in ignored_files]
+    return to_ingest
 
-    #Multithread loading
-    with Pool(processes=os.cpu_count()) as pool:
 
-        results = []
 
-        #loop while updating progress bar
-        with tqdm(total=len(filtered_files), desc='Loading new documents', ncols=80) as pbar:
 
-            #load_single_document (defined above) is passed into this loop as a lambda function
-            for i, docs in enumerate(pool.imap_unordered(load_single_document, filtered_files)):
-                
-                #capture the loaded docs
-                results.extend(docs)
+def iter_documents(filtered_files: List[str]) -> Iterator[tuple]:
+    """
+    Generator yielding (file_path, parsed documents) for one file at a time.
+    Loader processes run ahead of the consumer, but only a bounded window of
+    tasks is in flight so memory stays flat however large the corpus is.
+    """
+    # work out each file's loader tasks up front, fanning very large PDFs
+    # into one page-range task per worker - only the page count is read
+    # here, no content is parsed
+    file_tasks = []
+    total_tasks = 0
+    for file_path in filtered_files:
+        ranges = large_pdf_page_ranges(file_path)
+        if ranges:
+            parts = [(load_pdf_pages, (file_path, start, stop)) for start, stop in ranges]
+        else:
+            parts = [(load_single_document, (file_path,))]
+        file_tasks.append((file_path, parts))
+        total_tasks += len(parts)
+
+    #Multiprocess loading - size the pool by tasks rather than files so a
+    #run whose only new file is one huge PDF still gets a full pool, and
+    #keep only a bounded window of tasks in flight for backpressure
+    workers = min(ingest_workers, max(1, total_tasks))
+    in_flight_window = workers * 4
+    file_queue = deque(file_tasks)
+    futures = deque()
+    in_flight = 0
+
+    # prefer fork where available (Linux) so workers share the parent's
+    # already-imported modules copy-on-write; on spawn platforms (macOS,
+    # Windows) the initializer pays the heavy loader imports once per
+    # worker instead of on each worker's first file
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    mp_context = multiprocessing.get_context(start_method)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=init_loader_worker) as executor, \
+         tqdm(total=len(filtered_files), desc='Loading new documents', ncols=80) as pbar:
+
+        while file_queue or futures:
+
+            #top up the in-flight window
+            while file_queue and in_flight < in_flight_window:
+                file_path, file_parts = file_queue.popleft()
+                parts = [executor.submit(task, *args) for task, args in file_parts]
+                in_flight += len(parts)
+                futures.append((file_path, parts))
+
+            file_path, parts = futures.popleft()
+            try:
+                #collect the loaded docs, with a per-task timeout so one
+                #hung loader (e.g. a broken PDF) cannot stall the whole run
+                yield file_path, [doc for part in parts
+                                  for doc in part.result(timeout=load_timeout)]
+            except TimeoutError:
+                logging.warning(f"Timed out loading {file_path} - skipping")
+            except Exception as e:
+                logging.warning(f"Failed to load {file_path}: {e} - skipping")
 
-                #update the progress bar
-                pbar.update()
+            in_flight -= len(parts)
 
-    return results
+            #update the progress bar
+            pbar.update()
 
 
 
 
-def process_documents(ignored_files: List[str] = []) -> List[Document]:
+def ingest_documents(db: Chroma, ignored_files: List[str] = []) -> int:
     """
-    Load documents and split in chunks
+    Stream documents through the splitter and embedder into Chroma.
+    Chunks are flushed every chunk_batch_size, so peak memory no longer grows
+    with corpus size (this replaces the old max-parts-per-run truncation).
+    A file is only recorded in the ingest index once every one of its chunks
+    has been written to Chroma - a crash mid-run cannot mark half-ingested
+    files as done. Returns the number of chunks written.
     """
     logging.info(f"Loading documents from {source_directory}")
-    documents = load_documents(source_directory, ignored_files)
+    files_to_ingest = select_files_to_ingest(db, ignored_files)
+
+    index = open_ingest_index()
+    total_chunks = 0
+    pending: List[Document] = []
+    # files whose chunks are still in the pending buffer, in buffer order:
+    # (path, mtime, size, number of chunks not yet flushed)
+    unflushed_files = deque()
+
+    def record_flushed(flushed: int) -> None:
+        '''Mark files whose chunks have all reached Chroma as ingested'''
+        while unflushed_files and unflushed_files[0][3] <= flushed:
+            path, mtime, size, outstanding = unflushed_files.popleft()
+            flushed -= outstanding
+            index.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                          (path, mtime, size))
+        if unflushed_files and flushed:
+            path, mtime, size, outstanding = unflushed_files[0]
+            unflushed_files[0] = (path, mtime, size, outstanding - flushed)
+        index.commit()
 
-    if not documents:
-        logging.info("No new documents to load")
-        exit(0)
+    try:
+        for file_path, docs in iter_documents(files_to_ingest):
+            chunks = split_documents(docs)
+            pending.extend(chunks)
+            stat = os.stat(file_path)
+            unflushed_files.append((file_path, stat.st_mtime, stat.st_size, len(chunks)))
 
-    #process can fail on laptop if we try to ingest too many documents/chunks at a time
-    logging.info(f"Found {len(documents)} new document parts from {source_directory}")
+            while len(pending) >= chunk_batch_size:
+                add_documents_batched(db, pending[:chunk_batch_size])
+                total_chunks += chunk_batch_size
+                pending = pending[chunk_batch_size:]
+                record_flushed(chunk_batch_size)
 
-    if(len(documents)>max_number_of_parts_per_run):
-         logging.info(f"truncating document list to max number of file parts per run: {max_number_of_parts_per_run}")
-         documents = documents[0:max_number_of_parts_per_run]
+        if pending:
+            add_documents_batched(db, pending)
+            total_chunks += len(pending)
+        record_flushed(len(pending))
+    finally:
+        index.close()
 
-    #Split the documents
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    texts = text_splitter.split_documents(documents)
-    logging.info(f"Split into {len(texts)} chunks of text (max. {chunk_size} tokens each)")
+    return total_chunks
 
-    return texts
+
+
+
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    '''Build the text splitter once, preferring the Rust-backed one'''
+
+    if RustTextSplitter is not None:
+        return RustTextSplitter(capacity=chunk_size, overlap=chunk_overlap)
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+
+
+# splitter results keyed by content digest alone - keying on the text itself
+# (as lru_cache would) pins thousands of full page texts in memory
+split_cache = {}
+split_cache_max_entries = 10000
+
+
+def split_text_cached(text: str) -> tuple:
+    """
+    Split one text into chunks, memoized by content digest - corporate
+    document sets repeat boilerplate pages (copyright notices, template
+    intros) and identical texts need only be split once
+    """
+    digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    chunks = split_cache.get(digest)
+
+    if chunks is None:
+        splitter = get_text_splitter()
+        if RustTextSplitter is not None:
+            chunks = tuple(splitter.chunks(text))
+        else:
+            chunks = tuple(splitter.split_text(text))
+
+        # simple size bound - dropping the whole cache is fine, it only
+        # costs re-splitting until the boilerplate entries fill back in
+        if len(split_cache) >= split_cache_max_entries:
+            split_cache.clear()
+        split_cache[digest] = chunks
+
+    return chunks
+
+
+
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """
+    Split documents into chunks, reusing cached results for repeated content
+    """
+    return [Document(page_content=chunk, metadata=document.metadata)
+            for document in documents
+            for chunk in split_text_cached(document.page_content)]
+
+
+
+
+def add_documents_batched(db: Chroma, texts: List[Document]) -> None:
+    """
+    Embed and upsert chunks into Chroma in fixed-size batches.
+    Chunks are length-sorted and bucketed so each encoder batch holds texts
+    of similar length, minimising the compute wasted on padding tokens.
+    Insertion order does not affect HNSW correctness.
+    """
+    remaining = sorted(texts, key=lambda text: len(text.page_content))
+    embeddings = get_embeddings()
+
+    for max_length, encode_batch_size in length_buckets:
+        bucket = [text for text in remaining if len(text.page_content) < max_length]
+        remaining = remaining[len(bucket):]
+        if not bucket:
+            continue
+
+        set_encode_batch_size(embeddings, encode_batch_size)
+        for i in range(0, len(bucket), db_batch_size):
+            db.add_documents(bucket[i:i + db_batch_size])
 
 
 
 
 def does_vectorstore_exist(persist_directory: str) -> bool:
     """
-    Checks if vectorstore exists
+    Checks if a populated vectorstore exists under the persist directory
     """
-    if os.path.exists(os.path.join(persist_directory, 'index')):
-        if os.path.exists(os.path.join(persist_directory, 'chroma-collections.parquet')) and os.path.exists(os.path.join(persist_directory, 'chroma-embeddings.parquet')):
-            list_index_files = glob.glob(os.path.join(persist_directory, 'index/*.bin'))
-            list_index_files += glob.glob(os.path.join(persist_directory, 'index/*.pkl'))
+    # one stat avoids waking the whole client stack when there is no store yet
+    if not os.path.exists(os.path.join(persist_directory, 'chroma.sqlite3')):
+        return False
 
-            # At least 3 documents are needed in a working vectorstore
-            if len(list_index_files) > 3:
-                return True
-    #default        
-    return False
+    try:
+        return get_chroma_client().get_collection(COLLECTION_NAME).count() > 0
+    except Exception:
+        # client raises if the collection has not been created yet
+        return False
 
 
 
@@ -189,30 +513,35 @@ def does_vectorstore_exist(persist_directory: str) -> bool:
 def main():
 
 
-    # Create embeddings
-    embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
+    # Create embeddings (cached so repeat runs skip the model reload)
+    embeddings = get_embeddings()
+
+    db = Chroma(client=get_chroma_client(), collection_name=COLLECTION_NAME,
+                embedding_function=embeddings, collection_metadata=COLLECTION_METADATA)
 
     if does_vectorstore_exist(persist_directory):
 
         # Update and store locally vectorstore
         logging.info(f"Appending to existing vectorstore at {persist_directory}")
-        db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS)
+        prune_deleted_files(db)
         collection = db.get()
-        texts = process_documents([metadata['source'] for metadata in collection['metadatas']])
-        if(len(texts)>0):
-            logging.info(f"Creating embeddings. May take some minutes...")
-            db.add_documents(texts)
-        else:
-            logging.info(f"No new documents embeddings found")
+        ignored_files = [metadata['source'] for metadata in collection['metadatas']]
     else:
-        # Create and store locally vectorstore
+        # Create and store locally vectorstore - clear any ingest index left
+        # over from a deleted db so every source file is treated as new
         logging.info("Creating new vectorstore")
-        texts = process_documents()
-        logging.info(f"Creating database and embeddings. May take some minutes...")
-        db = Chroma.from_documents(texts, embeddings, persist_directory=persist_directory, client_settings=CHROMA_SETTINGS)
+        reset_ingest_index()
+        ignored_files = []
+
+    logging.info(f"Creating embeddings. May take some minutes...")
+    total_chunks = ingest_documents(db, ignored_files)
+
+    if total_chunks > 0:
+        logging.info(f"Ingested {total_chunks} chunks of text (max. {chunk_size} tokens each)")
+    else:
+        logging.info(f"No new documents embeddings found")
 
-    # persist our vector store and release connnection    
-    db.persist()
+    # release connnection - the persistent client flushes writes as they land
     db = None
 
     logging.info(f"Ingestion complete! You can now run privateGPT.py to query your documents")
@@ -1,69 +1,112 @@
 #!/usr/bin/env python3
 from dotenv import load_dotenv
-from langchain.chains import RetrievalQA
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.chains.question_answering import load_qa_chain
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from langchain.docstore.document import Document
 from langchain.vectorstores import Chroma
-from langchain.llms import GPT4All, LlamaCpp
-from constants import CHROMA_SETTINGS
+from constants import COLLECTION_NAME, get_chroma_client
+from embeddings import get_embeddings
 
 import os
 import sys
 import argparse
 import logging
 import time
+import torch
 
 load_dotenv()
 
-embeddings_model_name = os.environ.get("EMBEDDINGS_MODEL_NAME")
-persist_directory = os.environ.get('PERSIST_DIRECTORY')
-
 model_type = os.environ.get('MODEL_TYPE')
 model_path = os.environ.get('MODEL_PATH')
 model_n_ctx = os.environ.get('MODEL_N_CTX')
-model_n_batch = int(os.environ.get('MODEL_N_BATCH',8))
+model_n_batch = int(os.environ.get('MODEL_N_BATCH',512))
+model_n_threads = int(os.environ.get('MODEL_N_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+model_n_gpu_layers = int(os.environ.get('MODEL_N_GPU_LAYERS',0))
 target_source_chunks = int(os.environ.get('TARGET_SOURCE_CHUNKS',4))
 
 
+def build_llama_cpp(callbacks):
+    '''Build the LlamaCpp LLM, importing its heavy backend only when chosen'''
+    from langchain.llms import LlamaCpp
+    # n_batch scales prompt throughput almost linearly; mmap-ed weights and an
+    # FP16 KV cache keep memory in check, n_threads should match physical cores
+    return LlamaCpp(model_path=model_path, max_tokens=model_n_ctx, n_batch=model_n_batch,
+                    n_threads=model_n_threads, n_gpu_layers=model_n_gpu_layers,
+                    use_mmap=True, use_mlock=False, f16_kv=True,
+                    callbacks=callbacks, verbose=False)
+
+
+def build_gpt4all(callbacks):
+    '''Build the GPT4All LLM, importing its heavy backend only when chosen'''
+    # currently this is the default model
+    from langchain.llms import GPT4All
+    return GPT4All(model=model_path, max_tokens=model_n_ctx, backend='gptj', n_batch=model_n_batch,
+                   n_threads=model_n_threads, callbacks=callbacks, verbose=False)
+
+
+# map MODEL_TYPE to a factory so only the chosen backend gets imported -
+# importing both pulls in llama-cpp and gpt4all native libs on every start
+LLM_FACTORIES = {
+    "LlamaCpp": build_llama_cpp,
+    "GPT4All": build_gpt4all,
+}
+
+
 def main(questions=[]):
     
     # Parse the command line arguments
     args = parse_arguments()
 
+    # tune torch threading for CPU inference - the defaults oversubscribe
+    # cores and can make sentence-transformer encoding many times slower
+    torch.set_num_threads(min(8, os.cpu_count() or 1))
+    torch.set_num_interop_threads(1)
+
     # load embeddings db connection using this and environmental settings
-    embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
-    db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS)
-    retriever = db.as_retriever(search_kwargs={"k": target_source_chunks})
+    embeddings = get_embeddings()
+
+    # warm the model up front so the first real question does not pay the
+    # cold-start cost of faulting in weights and tokenizer state
+    embeddings.embed_query("warmup")
+    db = Chroma(client=get_chroma_client(), collection_name=COLLECTION_NAME, embedding_function=embeddings)
+
+    # embed every question in one batched forward pass and retrieve all the
+    # source chunks up front - 16 single-sample passes cost far more than
+    # one batch of 16, and only the LLM step needs to stay sequential
+    retrieved = {}
+    if questions:
+        query_vectors = embeddings.embed_documents(questions)
+        results = db._collection.query(query_embeddings=query_vectors,
+                                       n_results=target_source_chunks,
+                                       include=["documents", "metadatas"])
+        for i, query in enumerate(questions):
+            retrieved[query] = [Document(page_content=content, metadata=metadata)
+                                for content, metadata in zip(results["documents"][i], results["metadatas"][i])]
 
     # activate/deactivate the streaming StdOut callback for LLMs
     callbacks = [] if args.mute_stream else [StreamingStdOutCallbackHandler()]
 
-    # Prepare the LLM
-    match model_type:
-        case "LlamaCpp":
-            llm = LlamaCpp(model_path=model_path, max_tokens=model_n_ctx, n_batch=model_n_batch, callbacks=callbacks, verbose=False)
-        
-        case "GPT4All":
-            # currently this is the default model
-            llm = GPT4All(model=model_path, max_tokens=model_n_ctx, backend='gptj', n_batch=model_n_batch, callbacks=callbacks, verbose=False)
-
-        case _default:
-            # raise exception if model_type is not supported
-            raise Exception(f"Model type {model_type} is not supported. Please choose one of the following: LlamaCpp, GPT4All")
-
-    #retrieve an handle to the interfacr from the choosen model, passing in link to our vector DB    
-    qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever, return_source_documents= not args.hide_source)
-    
+    # Prepare the LLM via the lazy factory map
+    if model_type not in LLM_FACTORIES:
+        # raise exception if model_type is not supported
+        raise Exception(f"Model type {model_type} is not supported. Please choose one of the following: {', '.join(LLM_FACTORIES)}")
+
+    llm = LLM_FACTORIES[model_type](callbacks)
+
+    #retrieve a handle to the QA interface from the choosen model - retrieval
+    #already happened above, so the chain only stuffs the docs into the prompt
+    qa = load_qa_chain(llm=llm, chain_type="stuff")
+
     # Non-Interactive questions and answers
     for query in questions:
 
         # print the question
         logging.info("\n\n> Question:"+query)
 
-        # Get the answer from the chain
+        # Get the answer from the chain, using the pre-retrieved source chunks
         start = time.time()
-        res = qa(query)
-        answer, docs = res['result'], [] if args.hide_source else res['source_documents']
+        res = qa({"input_documents": retrieved[query], "question": query})
+        answer, docs = res['output_text'], [] if args.hide_source else retrieved[query]
         end = time.time()
 
         # Print the Answer
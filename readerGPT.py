@@ -1,51 +1,56 @@
 # because prompt generation can be slow, we have a reader to "playback" logs
 
 
+import sys
 import time
-from termcolor import colored, cprint
 
 # contants
-line_delay = 0.01 # in seconds
 line_question ="> Question"
 line_answer="> Answer"
 line_source="> source_documents"
+flush_every = 10 # lines written between stdout flushes
+
+# precomputed ANSI colour prefixes - rebuilding the escape codes per line
+# through termcolor burned CPU for no visual difference
+prefix_default = "\x1b[2;37m"   # dim light grey
+prefix_question = "\x1b[1;97m"  # bold white
+prefix_answer = "\x1b[94m"      # light blue
+prefix_source = "\x1b[90m"      # dark grey
+reset = "\x1b[0m"
 
 #Code
-file1 = open('privateGPT.log', 'r')
-Lines = file1.readlines()
+with open('privateGPT.log', 'r') as file1:
+    Lines = file1.readlines()
 
 #default settings pre loop
-effects=["dark"]
-pcolour="light_grey"
+prefix = prefix_default
 delay=0
- 
 
 # Loop and print lines
-for line in Lines:
-    
+for line_number, line in enumerate(Lines):
+
     #set colour - it continues that colour until otherwise set
     if line.startswith(line_question):
         #question
-        effects=["bold"]
-        pcolour="white"
+        prefix = prefix_question
         delay=3.2
 
-    if line.startswith(line_answer):
+    elif line.startswith(line_answer):
         #default
-        effects=[]
-        pcolour="light_blue"
+        prefix = prefix_answer
         delay=0.8
 
-    if line.startswith(line_source):
+    elif line.startswith(line_source):
         #default
-        effects=[]
-        pcolour="dark_grey"
+        prefix = prefix_source
         delay=0.1
 
-    # print the line
-    print(colored(line, pcolour, attrs=effects), end='')
-
-    
+    # write the raw coloured line, batching flushes
+    sys.stdout.write(prefix + line + reset)
+    if line_number % flush_every == 0:
+        sys.stdout.flush()
 
     # calculate the sleep time
-    time.sleep(delay)
\ No newline at end of file
+    time.sleep(delay)
+
+sys.stdout.flush()
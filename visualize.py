@@ -1,21 +1,18 @@
 # visualise the document network 
 # draws on example from https://github.com/mtybadger/chromaviz
 
-import os
 from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
-from constants import CHROMA_SETTINGS
+from constants import COLLECTION_NAME, get_chroma_client
+from embeddings import get_embeddings
 from chromaviz import visualize_collection
 
 #get settings to connect to database
-load_dotenv() 
-embeddings_model_name = os.environ.get("EMBEDDINGS_MODEL_NAME")
-persist_directory = os.environ.get('PERSIST_DIRECTORY')
+load_dotenv()
 
 #create the chroma db connection
-embeddings = HuggingFaceEmbeddings(model_name=embeddings_model_name)
-db = Chroma(persist_directory=persist_directory, embedding_function=embeddings, client_settings=CHROMA_SETTINGS)
+embeddings = get_embeddings()
+db = Chroma(client=get_chroma_client(), collection_name=COLLECTION_NAME, embedding_function=embeddings)
 
 # Start a webserver to visualise the document collection
 # available at http://localhost:5000